@@ -1,15 +1,174 @@
 import requests
-import json
-import smtplib
+from requests.adapters import HTTPAdapter
+import orjson
+import hashlib
 import os
+import sys
 import time
-from email.mime.text import MIMEText
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # File paths
 CONFIG_FILE = "config.json"
-WATCHLIST_FILE = "watchlist.json"
+WATCHLIST_FILE = "watchlist.jsonl"
+LEGACY_WATCHLIST_FILE = "watchlist.json"
 ALERT_LOG_FILE = "alerts.log"
+CACHE_DIR = ".cache"
+
+# Maximum symbols per REALTIME_BULK_QUOTES request
+BULK_QUOTE_CHUNK = 100
+
+# Quotes update at most once a minute, so anything newer is still current
+CACHE_TTL = 60
+
+# Alpha Vantage free tier allows 5 calls per minute
+API_CALLS_PER_MINUTE = 5
+
+class RateLimiter:
+    """Allow at most `calls` acquisitions in any `period` second window"""
+
+    def __init__(self, calls, period):
+        self.calls = calls
+        self.period = period
+        self.history = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Forget calls that have left the window
+                self.history = [t for t in self.history if now - t < self.period]
+                if len(self.history) < self.calls:
+                    self.history.append(now)
+                    return
+                wait = self.period - (now - self.history[0])
+            time.sleep(wait)
+
+class FileCache:
+    """Tiny on-disk cache of API responses with a per-entry TTL"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached payload, or None if missing or expired"""
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        # Treat anything we didn't write ourselves as a miss
+        if not isinstance(entry, dict):
+            return None
+        try:
+            if time.time() - entry.get("ts", 0) > entry.get("ttl", 0):
+                return None
+        except TypeError:
+            return None
+        return entry.get("payload")
+
+    def set(self, key, payload, ttl=CACHE_TTL):
+        entry = {"ts": time.time(), "ttl": ttl, "payload": payload}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(key), "wb") as f:
+                f.write(orjson.dumps(entry))
+        except OSError as e:
+            print(f"Could not write cache: {e}")
+
+cache = FileCache(CACHE_DIR)
+
+# One session for all API calls so connections are kept alive and reused
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=API_CALLS_PER_MINUTE))
+
+# Shared by every check so back-to-back checks stay within the quota
+_LIMITER = RateLimiter(API_CALLS_PER_MINUTE, 60)
+
+# First retry waits one quota slot, later ones double up to a full window
+RETRY_BASE_WAIT = 60 / API_CALLS_PER_MINUTE
+MAX_RETRY_WAIT = 60
+
+def _throttle_message(data):
+    """Return the API's rate limit message if this response is one, else None"""
+    if not isinstance(data, dict):
+        return None
+    # Older responses use "Note", current ones use "Information"
+    note = str(data.get("Note", ""))
+    if "call frequency" in note:
+        return note
+    info = str(data.get("Information", ""))
+    if "rate limit" in info.lower() or "call frequency" in info:
+        return info
+    return None
+
+def _get_with_backoff(session, url, params, tries=4, limiter=None, label=None):
+    """GET and parse JSON, retrying with exponential back-off on rate limits
+
+    Returns None if we're still rate limited after all the tries.
+    """
+    label = label or params.get("symbol", url)
+    for attempt in range(tries):
+        if limiter:
+            limiter.acquire()
+        r = session.get(url, params=params, timeout=10)
+        
+        # 429 bodies usually aren't JSON, so check the status before parsing
+        if r.status_code != 429:
+            data = orjson.loads(r.content) if r.content else {}
+            message = _throttle_message(data)
+            if message is None:
+                return data
+            
+            # Waiting a minute won't help once the daily quota is used up
+            if "per day" in message:
+                print(f"Daily API limit reached, skipping {label}")
+                return None
+        
+        if attempt == tries - 1:
+            break
+        
+        # Prefer the server's hint on how long to wait
+        try:
+            wait = min(MAX_RETRY_WAIT, max(0, float(r.headers["Retry-After"])))
+        except (KeyError, ValueError):
+            wait = min(MAX_RETRY_WAIT, RETRY_BASE_WAIT * 2 ** attempt)
+        print(f"Hit API rate limit for {label}. Retrying in {wait:g} seconds...")
+        time.sleep(wait)
+    
+    print(f"Still rate limited for {label}, giving up for now")
+    return None
+
+# Format of a single alert log line
+_LINE_FMT = "[{ts}] ALERT: {sym} at ${p:.2f} (target: ${t:.2f} {d})\n"
+
+# Alert log stays open between alerts and is flushed in batches
+ALERT_LOG_FLUSH_EVERY = 10
+_alert_log = None
+_alert_log_pending = 0
+
+def log_alert(line):
+    """Append a line to the alert log, flushing every few alerts"""
+    global _alert_log, _alert_log_pending
+    if _alert_log is None:
+        _alert_log = open(ALERT_LOG_FILE, "a", buffering=8192)
+    _alert_log.write(line)
+    _alert_log_pending += 1
+    if _alert_log_pending >= ALERT_LOG_FLUSH_EVERY:
+        flush_alert_log()
+
+def flush_alert_log():
+    """Push any buffered alert lines to disk"""
+    global _alert_log_pending
+    if _alert_log is not None:
+        _alert_log.flush()
+    _alert_log_pending = 0
 
 def load_config():
     # Try to load config or create a template if it doesn't exist
@@ -25,13 +184,13 @@ def load_config():
             "SMTP_PORT": 465
         }
         
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(template, f, indent=2)
+        with open(CONFIG_FILE, "wb") as f:
+            f.write(orjson.dumps(template, option=orjson.OPT_INDENT_2))
         exit(1)
         
     # Load and validate config
-    with open(CONFIG_FILE) as f:
-        config = json.load(f)
+    with open(CONFIG_FILE, "rb") as f:
+        config = orjson.loads(f.read())
     
     # Check required fields
     missing = []
@@ -46,41 +205,51 @@ def load_config():
         
     return config
 
-def get_current_price(symbol, api_key):
+def _quote_cache_key(symbol, api_key):
+    return hashlib.md5(f"{symbol}:{api_key[:4]}:GLOBAL_QUOTE".encode()).hexdigest()
+
+def get_cached_price(symbol, api_key):
+    """Return a recently fetched price for symbol, or None"""
+    data = cache.get(_quote_cache_key(symbol, api_key))
+    try:
+        return float(data["Global Quote"]["05. price"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_current_price(symbol, api_key, limiter=None):
     """Get the latest stock price from Alpha Vantage"""
     url = f"https://www.alphavantage.co/query"
     params = {
-        "function": "TIME_SERIES_INTRADAY",
+        "function": "GLOBAL_QUOTE",
         "symbol": symbol,
-        "interval": "1min",
         "apikey": api_key
     }
+    key = _quote_cache_key(symbol, api_key)
     
     try:
-        r = requests.get(url, params=params, timeout=10)
-        data = r.json()
+        # Serve from cache when we already have a recent response
+        data = cache.get(key)
+        cached = data is not None
+        if not cached:
+            data = _get_with_backoff(_SESSION, url, params, limiter=limiter)
+            if data is None:
+                return None
         
         # Check for API errors
         if "Error Message" in data:
             print(f"API error for {symbol}: {data['Error Message']}")
             return None
             
-        # Check for rate limit message
-        if "Note" in data and "call frequency" in data["Note"]:
-            print(f"Hit API rate limit. Waiting 60 seconds...")
-            time.sleep(60)
-            return None
-            
         # Get latest price
-        time_series = data.get("Time Series (1min)", {})
-        if not time_series:
+        quote = data.get("Global Quote", {})
+        if not quote:
             print(f"No data returned for {symbol}")
             return None
             
-        # Find the most recent data point
-        latest_time = sorted(time_series.keys())[-1]
-        price = float(time_series[latest_time]["1. open"])
+        price = float(quote["05. price"])
         
+        if not cached:
+            cache.set(key, data, ttl=CACHE_TTL)
         return price
         
     except requests.exceptions.Timeout:
@@ -94,61 +263,222 @@ def get_current_price(symbol, api_key):
     
     return None
 
+# Set once the API tells us bulk quotes aren't available for this key
+_bulk_unavailable = False
+
+def get_bulk_quotes(symbols, api_key, limiter=None):
+    """Get latest prices for many symbols at once, as {symbol: price}
+
+    Symbols the bulk endpoint doesn't return are simply left out, so the
+    caller can fall back to get_current_price for them.
+    """
+    global _bulk_unavailable
+    quotes = {}
+    if _bulk_unavailable:
+        return quotes
+    
+    url = "https://www.alphavantage.co/query"
+    for i in range(0, len(symbols), BULK_QUOTE_CHUNK):
+        chunk = symbols[i:i + BULK_QUOTE_CHUNK]
+        params = {
+            "function": "REALTIME_BULK_QUOTES",
+            "symbol": ",".join(chunk),
+            "apikey": api_key
+        }
+        
+        try:
+            data = _get_with_backoff(
+                _SESSION, url, params, limiter=limiter,
+                label=f"bulk quotes ({len(chunk)} symbols)"
+            )
+            if data is None:
+                continue
+            
+            if "data" not in data:
+                # Free tier keys are told this is a premium endpoint. Throttle
+                # notices also mention premium plans, so match the exact wording
+                if "premium endpoint" in str(data.get("Information", "")).lower():
+                    print("Bulk quotes unavailable, checking symbols one at a time")
+                    _bulk_unavailable = True
+                    break
+                
+                # Anything else is a one-off, these symbols fall back individually
+                message = data.get("Error Message") or data.get("Information") or "no data returned"
+                print(f"Bulk quote error: {message}")
+                continue
+            
+            for quote in data["data"]:
+                try:
+                    symbol = quote["symbol"]
+                    price = float(quote["close"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                quotes[symbol] = price
+                
+                # Cache in the single-quote shape so both paths share entries
+                cache.set(
+                    _quote_cache_key(symbol, api_key),
+                    {"Global Quote": {"01. symbol": symbol, "05. price": quote["close"]}},
+                    ttl=CACHE_TTL
+                )
+                    
+        except requests.exceptions.RequestException as e:
+            print(f"Bulk quote request failed: {e}")
+        except ValueError as e:
+            print(f"Bulk quote data error: {e}")
+    
+    return quotes
+
 def load_watchlist():
-    """Load the watchlist from disk"""
+    """Load the watchlist from disk by replaying its log, indexed by symbol"""
     if not os.path.exists(WATCHLIST_FILE):
-        return []
+        return load_legacy_watchlist()
+    
+    stocks = {}
+    skipped = 0
+    with open(WATCHLIST_FILE, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+                symbol = record['symbol']
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                skipped += 1
+                continue
+            
+            # Tombstones drop the stock, full records (re)create it and
+            # status records only update stocks we already know about
+            if record.get('deleted'):
+                stocks.pop(symbol, None)
+            elif 'target' in record and 'direction' in record:
+                stocks[symbol] = record
+            elif symbol in stocks and 'alerted' in record:
+                stocks[symbol]['alerted'] = record['alerted']
+            else:
+                skipped += 1
+    
+    if skipped:
+        print(f"Skipped {skipped} corrupted or orphaned watchlist records, use 'compact' to clean up")
+    return stocks
+
+def load_legacy_watchlist():
+    """Import a watchlist saved in the old single JSON file format"""
+    if not os.path.exists(LEGACY_WATCHLIST_FILE):
+        return {}
         
     try:
-        with open(WATCHLIST_FILE) as f:
-            return json.load(f)
-    except json.JSONDecodeError:
+        with open(LEGACY_WATCHLIST_FILE, "rb") as f:
+            stocks = {entry['symbol']: entry for entry in orjson.loads(f.read())}
+    except (orjson.JSONDecodeError, KeyError, TypeError):
         print("Watchlist file corrupted, creating new one")
-        return []
+        return {}
+    
+    # Write it out in the new format so later appends build on it
+    try:
+        save_watchlist(stocks)
+    except OSError as e:
+        print(f"Could not convert watchlist to {WATCHLIST_FILE}: {e}")
+    return stocks
+
+def append_watchlist(*records):
+    """Append change records to the watchlist log in a single write"""
+    if not records:
+        return
+    data = b"".join(orjson.dumps(record) + b"\n" for record in records)
+    
+    # Don't glue new records onto a line left half-written by a crash
+    try:
+        with open(WATCHLIST_FILE, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+    except OSError:
+        pass
+    
+    with open(WATCHLIST_FILE, "ab") as f:
+        f.write(data)
 
 def save_watchlist(stocks):
-    """Save the watchlist to disk"""
-    with open(WATCHLIST_FILE, "w") as f:
-        json.dump(stocks, f, indent=2)
+    """Rewrite the watchlist log from scratch with one record per stock"""
+    # Serialize first so the file is written in one go
+    data = b"".join(orjson.dumps(stock) + b"\n" for stock in stocks.values())
+    tmp_file = WATCHLIST_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file, WATCHLIST_FILE)
 
-def send_alert(symbol, price, target, direction, config):
-    """Send an email alert when price conditions are met"""
-    subject = f"Stock Alert: {symbol} ${price:.2f}"
-    
-    # Create a more informative message body
-    body = f"""
+class AlertSender:
+    """Send email alerts over one SMTP connection, opened on first use"""
+
+    def __init__(self, config):
+        self.email = config['EMAIL']
+        self.password = config['EMAIL_PASSWORD']
+        self.smtp_server = config['SMTP_SERVER']
+        self.smtp_port = config['SMTP_PORT']
+        self.server = None
+
+    def _connect(self):
+        import smtplib
+        self.server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
+        self.server.login(self.email, self.password)
+
+    def send(self, symbol, price, target, direction):
+        """Send an email alert when price conditions are met"""
+        # Only needed once an alert actually fires
+        import smtplib
+        from email.mime.text import MIMEText
+        
+        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        subject = f"Stock Alert: {symbol} ${price:.2f}"
+        
+        # Create a more informative message body
+        body = f"""
 STOCK PRICE ALERT
 
 Symbol: {symbol}
 Current Price: ${price:.2f}
 Target: ${target:.2f} ({direction})
-Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Time: {ts}
 
 This is an automated alert from your Stock Price Alert system.
 """
 
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = config['EMAIL']
-    msg['To'] = config['EMAIL']
-    
-    try:
-        server = smtplib.SMTP_SSL(config['SMTP_SERVER'], config['SMTP_PORT'])
-        server.login(config['EMAIL'], config['EMAIL_PASSWORD'])
-        server.send_message(msg)
-        server.close()
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.email
+        msg['To'] = self.email
         
-        # Log the alert
-        with open(ALERT_LOG_FILE, "a") as log:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log.write(f"[{timestamp}] ALERT: {symbol} at ${price:.2f} (target: ${target:.2f} {direction})\n")
+        try:
+            if self.server is None:
+                self._connect()
+            try:
+                self.server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # Server dropped the idle connection, reconnect once
+                self._connect()
+                self.server.send_message(msg)
             
-        print(f"✓ Alert sent for {symbol}")
-        return True
-        
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
+            # Log the alert
+            log_alert(_LINE_FMT.format(ts=ts, sym=symbol, p=price, t=target, d=direction))
+                
+            print(f"✓ Alert sent for {symbol}")
+            return True
+            
+        except Exception as e:
+            print(f"Failed to send email: {e}")
+            self.close()
+            return False
+
+    def close(self):
+        """Close the SMTP connection if one is open"""
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
 
 def display_watchlist(stocks):
     """Show the watchlist in a nicely formatted table"""
@@ -159,18 +489,22 @@ def display_watchlist(stocks):
     # Calculate column widths based on content
     headers = ["Symbol", "Target", "Direction", "Status", "Added"]
     
-    print("\nWatchlist:")
-    print("─" * 65)
-    print(f"{headers[0]:<8} {headers[1]:<10} {headers[2]:<10} {headers[3]:<10} {headers[4]}")
-    print("─" * 65)
+    # Build the whole table first and write it out in one go
+    lines = [
+        "\nWatchlist:",
+        "─" * 65,
+        f"{headers[0]:<8} {headers[1]:<10} {headers[2]:<10} {headers[3]:<10} {headers[4]}",
+        "─" * 65
+    ]
     
-    for stock in stocks:
+    for stock in stocks.values():
         status = "ALERTED" if stock.get('alerted') else "watching"
         added_date = stock.get('added', 'unknown')
-        print(f"{stock['symbol']:<8} ${stock['target']:<9.2f} {stock['direction']:<10} {status:<10} {added_date}")
+        lines.append(f"{stock['symbol']:<8} ${stock['target']:<9.2f} {stock['direction']:<10} {status:<10} {added_date}")
     
-    print("─" * 65)
-    print(f"Total: {len(stocks)} stocks\n")
+    lines.append("─" * 65)
+    lines.append(f"Total: {len(stocks)} stocks\n")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def check_prices(stocks, config):
     """Check current prices against targets for all stocks"""
@@ -178,39 +512,62 @@ def check_prices(stocks, config):
         print("Watchlist is empty. Add stocks first.")
         return
     
-    changes = False
+    changes = []
     print(f"Checking prices for {len(stocks)} stocks...")
     
-    for i, stock in enumerate(stocks):
-        # Skip if already alerted
+    # Skip if already alerted
+    pending = []
+    for stock in stocks.values():
         if stock.get('alerted'):
             print(f"{stock['symbol']}: Already triggered, use 'reset' to check again")
-            continue
-            
-        # Add delay between API calls to respect rate limits
-        if i > 0:
-            time.sleep(12)  # Alpha Vantage free tier allows 5 calls per minute
-        
-        # Get current price
-        price = get_current_price(stock['symbol'], config['API_KEY'])
-        if price is None:
-            continue
-            
-        # Check if alert conditions are met
-        target = stock['target']
-        direction = stock['direction']
-        
-        if (direction == 'above' and price >= target) or (direction == 'below' and price <= target):
-            # Send the alert
-            if send_alert(stock['symbol'], price, target, direction, config):
-                stock['alerted'] = True
-                changes = True
         else:
-            print(f"{stock['symbol']}: ${price:.2f} (target: ${target:.2f} {direction})")
+            pending.append(stock)
+    
+    # Use recent prices from the cache before going to the API
+    quotes = {}
+    for stock in pending:
+        price = get_cached_price(stock['symbol'], config['API_KEY'])
+        if price is not None:
+            quotes[stock['symbol']] = price
+    
+    # Try to get everything else in as few requests as possible
+    uncached = [s['symbol'] for s in pending if s['symbol'] not in quotes]
+    if len(uncached) > 1:
+        quotes.update(get_bulk_quotes(uncached, config['API_KEY'], _LIMITER))
+    
+    # Fetch the rest concurrently, the limiter keeps us within the API quota
+    missing = [s['symbol'] for s in pending if s['symbol'] not in quotes]
+    with ThreadPoolExecutor(max_workers=API_CALLS_PER_MINUTE) as pool:
+        prices = pool.map(
+            lambda symbol: get_current_price(symbol, config['API_KEY'], _LIMITER),
+            missing
+        )
+        quotes.update(zip(missing, prices))
+    
+    sender = AlertSender(config)
+    try:
+        for stock in pending:
+            price = quotes.get(stock['symbol'])
+            if price is None:
+                continue
+                
+            # Check if alert conditions are met
+            target = stock['target']
+            direction = stock['direction']
+            
+            if (direction == 'above' and price >= target) or (direction == 'below' and price <= target):
+                # Send the alert
+                if sender.send(stock['symbol'], price, target, direction):
+                    stock['alerted'] = True
+                    changes.append({"symbol": stock['symbol'], "alerted": True})
+            else:
+                print(f"{stock['symbol']}: ${price:.2f} (target: ${target:.2f} {direction})")
+    finally:
+        sender.close()
+        flush_alert_log()
     
     # Save any changes to watch status
-    if changes:
-        save_watchlist(stocks)
+    append_watchlist(*changes)
 
 def main():
     # Setup and initialization
@@ -236,6 +593,7 @@ def main():
         "list": "Display your watchlist", 
         "check": "Check current prices against targets",
         "reset": "Reset triggered alerts",
+        "compact": "Rewrite the watchlist file without old history",
         "help": "Show available commands",
         "quit": "Exit the program"
     }
@@ -249,7 +607,7 @@ def main():
             if cmd == "help":
                 print("\nAvailable commands:")
                 for c, desc in commands.items():
-                    print(f"  {c:<6} - {desc}")
+                    print(f"  {c:<7} - {desc}")
                     
             elif cmd == "add":
                 # Get stock info
@@ -259,7 +617,7 @@ def main():
                     continue
                 
                 # Check if already in watchlist
-                if any(s['symbol'] == symbol for s in watchlist):
+                if symbol in watchlist:
                     print(f"{symbol} is already in your watchlist")
                     continue
                 
@@ -277,25 +635,22 @@ def main():
                     continue
                 
                 # Add to watchlist
-                watchlist.append({
+                watchlist[symbol] = {
                     "symbol": symbol,
                     "target": target,
                     "direction": direction,
                     "alerted": False,
                     "added": datetime.now().strftime("%Y-%m-%d")
-                })
-                save_watchlist(watchlist)
+                }
+                append_watchlist(watchlist[symbol])
                 print(f"Added {symbol} to watchlist")
                 
             elif cmd == "remove":
                 symbol = input("Symbol to remove: ").strip().upper()
                 
                 # Find and remove from watchlist
-                before_len = len(watchlist)
-                watchlist = [s for s in watchlist if s['symbol'] != symbol]
-                
-                if len(watchlist) < before_len:
-                    save_watchlist(watchlist)
+                if watchlist.pop(symbol, None) is not None:
+                    append_watchlist({"symbol": symbol, "deleted": True})
                     print(f"Removed {symbol} from watchlist")
                 else:
                     print(f"{symbol} not found in watchlist")
@@ -308,18 +663,22 @@ def main():
                 
             elif cmd == "reset":
                 # Reset all alerts
-                changes = False
-                for stock in watchlist:
+                changes = []
+                for stock in watchlist.values():
                     if stock.get('alerted'):
                         stock['alerted'] = False
-                        changes = True
+                        changes.append({"symbol": stock['symbol'], "alerted": False})
                 
                 if changes:
-                    save_watchlist(watchlist)
+                    append_watchlist(*changes)
                     print("All alerts have been reset")
                 else:
                     print("No triggered alerts to reset")
                     
+            elif cmd == "compact":
+                save_watchlist(watchlist)
+                print(f"Watchlist compacted to {len(watchlist)} records")
+                
             elif cmd == "quit" or cmd == "exit":
                 print("Goodbye!")
                 break